@@ -1,21 +1,26 @@
+import asyncio
 from collections import deque
+from dataclasses import dataclass
 from enum import IntEnum
-from piper_sdk import *
+import logging
+from piper_sdk import C_PiperInterface
 import time
 import math
+import threading
 
-import pydantic
-from pydantic import BaseModel, ConfigDict, TypeAdapter
+import numpy as np
+
+LOG = logging.getLogger(__name__)
 
 
 class BaseArm:
     def connect(self):
         pass
 
-    def enable(self):
+    async def enable(self):
         pass
 
-    def disable(self):
+    async def disable(self):
         pass
 
     def joint_ctrl(self, joints):
@@ -35,7 +40,8 @@ class MotionCtrl2CtrlMode(IntEnum):
     TEACHING_LINKAGE = 0x06
     OFFLINE_TRAJECTORY = 0x07
 
-class PiperJointStatus(BaseModel):
+@dataclass(slots=True)
+class PiperJointStatus:
     joint_1: int
     joint_2: int
     joint_3: int
@@ -47,21 +53,22 @@ class PiperJointStatus(BaseModel):
         return f"joint_1: {self.joint_1}, joint_2: {self.joint_2}, joint_3: {self.joint_3}, " \
                f"joint_4: {self.joint_4}, joint_5: {self.joint_5}, joint_6: {self.joint_6}"
 
-    @staticmethod
-    def validate_from_raw(raw_data: C_PiperInterface.ArmJoint):
-        data = {
-            "timestamp": raw_data.time_stamp,
-            "joint_1": raw_data.joint_state.joint_1,
-            "joint_2": raw_data.joint_state.joint_2,
-            "joint_3": raw_data.joint_state.joint_3,
-            "joint_4": raw_data.joint_state.joint_4,
-            "joint_5": raw_data.joint_state.joint_5,
-            "joint_6": raw_data.joint_state.joint_6
-        }
-
-        return PiperJointStatus(**data)
-
-class PiperArmStatus(BaseModel):
+    @classmethod
+    def validate_from_raw(cls, raw_data: C_PiperInterface.ArmJoint):
+        # the SDK struct is already typed, so build the record without validation
+        joint_state = raw_data.joint_state
+
+        return cls(
+            joint_state.joint_1,
+            joint_state.joint_2,
+            joint_state.joint_3,
+            joint_state.joint_4,
+            joint_state.joint_5,
+            joint_state.joint_6,
+        )
+
+@dataclass(slots=True)
+class PiperArmStatus:
     ctrl_mode: int
     arm_status: int
     mode_feed: int
@@ -75,169 +82,269 @@ class PiperArmStatus(BaseModel):
                f"teach_status: {self.teach_status}, motion_status: {self.motion_status}, " \
                f"trajectory_num: {self.trajectory_num}, err_code: {self.err_code}"
 
-    @staticmethod
-    def validate_from_raw(raw_data: C_PiperInterface.ArmStatus):
-        data = {
-            "timestamp": raw_data.time_stamp,
-            "ctrl_mode": raw_data.arm_status.ctrl_mode,
-            "arm_status": raw_data.arm_status.arm_status,
-            "mode_feed": raw_data.arm_status.mode_feed,
-            "teach_status": raw_data.arm_status.teach_status,
-            "motion_status": raw_data.arm_status.motion_status,
-            "trajectory_num": raw_data.arm_status.trajectory_num,
-            "err_code": raw_data.arm_status.err_code,
-            "err_status": raw_data.arm_status.err_status
-        }
-
-        return PiperArmStatus(**data)
+    @classmethod
+    def validate_from_raw(cls, raw_data: C_PiperInterface.ArmStatus):
+        arm_status = raw_data.arm_status
+
+        return cls(
+            arm_status.ctrl_mode,
+            arm_status.arm_status,
+            arm_status.mode_feed,
+            arm_status.teach_status,
+            arm_status.motion_status,
+            arm_status.trajectory_num,
+            arm_status.err_code,
+        )
+
+# get_motor_enable_mask() value with all six motor drivers enabled
+ALL_MOTORS_MASK = 0x3F
+
+# PiperArm instances shared by CAN device name, see PiperArm.get_or_create
+_ARM_REGISTRY = {}
+
+# JointCtrl takes int32 values in 0.001 degree
+JOINT_CMD_MAX = np.iinfo(np.int32).max
 
 class PiperArm(BaseArm):
     piper: C_PiperInterface
     speed_ratio: int = 30
+    # rate of the joint control loop and the per-tick smoothing factor
+    ctrl_rate: float = 200.0
+    ctrl_alpha: float = 0.2
+    # the loop idles once every joint is this close to the target (degrees),
+    # half of the 0.001 degree command resolution
+    ctrl_tolerance: float = 0.0005
     command_timestamps: deque
 
-    def __init__(self):
-        self.piper = C_PiperInterface()
+    def __init__(self, can_name="can0"):
+        self.can_name = can_name
+        self.piper = C_PiperInterface(can_name=can_name)
+        self.connected = False
         self.command_timestamps = deque(maxlen=10)
 
+        # scratch buffers reused by joint_ctrl to avoid per-call allocations
+        self._joint_scratch = np.empty(6, dtype=np.float64)
+        self._joint_int = np.empty(6, dtype=np.int32)
+
+        # latest requested and currently commanded joints, in degrees
+        self._target = np.zeros(6, dtype=np.float64)
+        self._current = np.zeros(6, dtype=np.float64)
+        self._step = np.empty(6, dtype=np.float64)
+        self._ctrl_lock = threading.Lock()
+        self._ctrl_stop = threading.Event()
+        # set when a new target arrives, wakes the loop once it has reached the last one
+        self._ctrl_wake = threading.Event()
+        self._ctrl_thread = None
+        # last MotionCtrl_2 arguments sent, so the mode frame is only resent on change
+        self._last_motion_ctrl = None
+
     def record_timestamp(self):
-        self.command_timestamps.append(time.time())
+        self.command_timestamps.append(time.monotonic())
 
     def calculate_average_rate(self):
-        if len(self.command_timestamps) < 2:
+        stamps = self.command_timestamps
+        if len(stamps) < 2:
             return 0
-        stamps = list(self.command_timestamps)
-        intervals = [t - s for s, t in zip(stamps, stamps[1:])]
+        # the mean of consecutive intervals telescopes to (last - first) / (n - 1)
+        span = stamps[-1] - stamps[0]
 
-        average_interval = sum(intervals) / len(intervals)
-        
-        return 1 / average_interval if average_interval > 0 else 0
+        return (len(stamps) - 1) / span if span > 0 else 0
+
+    @classmethod
+    def get_or_create(cls, can_name="can0"):
+        # one arm (and one SDK interface) per CAN device for the whole process
+        arm = _ARM_REGISTRY.get(can_name)
+        if arm is None:
+            arm = cls(can_name)
+            _ARM_REGISTRY[can_name] = arm
+
+        return arm
 
     def connect(self):
         # self.record_timestamp()
+        if self.connected:
+            return
         self.piper.ConnectPort()
+        self.connected = True
+
+    def get_motor_enable_mask(self):
+        # one snapshot of the low-speed feedback covers all six motors,
+        # packed as bit N-1 set when motor N's driver is enabled
+        msgs = self.piper.GetArmLowSpdInfoMsgs()
 
-    def enable(self):
+        return ((msgs.motor_1.foc_status.driver_enable_status & 1)
+                | (msgs.motor_2.foc_status.driver_enable_status & 1) << 1
+                | (msgs.motor_3.foc_status.driver_enable_status & 1) << 2
+                | (msgs.motor_4.foc_status.driver_enable_status & 1) << 3
+                | (msgs.motor_5.foc_status.driver_enable_status & 1) << 4
+                | (msgs.motor_6.foc_status.driver_enable_status & 1) << 5)
+
+    async def enable(self):
         # self.record_timestamp()
         piper = self.piper
 
         enable_flag = False
-        loop_flag = False
         timeout = 5
         start_time = time.time()
-        elapsed_time_flag = False
 
-        while not (loop_flag):
+        while True:
             elapsed_time = time.time() - start_time
-            print(f"--------------------")
-            
-            enable_list = []
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_1.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_2.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_3.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_4.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_5.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_6.foc_status.driver_enable_status)
-            enable_flag = all(enable_list)
+
+            enable_flag = self.get_motor_enable_mask() == ALL_MOTORS_MASK
 
             piper.EnableArm(7)
             piper.GripperCtrl(0, 1000, 0x00, 0)
-            
-            print(f"使能状态: {enable_flag}")
-            print(f"--------------------")
-            
-            if(enable_flag == True):
-                loop_flag = True
-                enable_flag = True
-            else: 
-                loop_flag = False
-                enable_flag = False
-            
+
+            if enable_flag:
+                break
+
             if elapsed_time > timeout:
-                print(f"超时....")
-                elapsed_time_flag = True
-                enable_flag = False
-                loop_flag = True
+                LOG.warning("超时....")
                 break
-            time.sleep(0.5)
+            await asyncio.sleep(0.05)
+
+        # re-enabling (e.g. after an e-stop or fault) drops the arm out of CAN
+        # control mode, so the next command must send MotionCtrl_2 again
+        with self._ctrl_lock:
+            self._last_motion_ctrl = None
 
         resp = enable_flag
-        print(f"Returning response: {resp}")
+        LOG.debug("Returning response: %s", resp)
 
         return resp
     
-    def disable(self):
+    async def disable(self):
         # self.record_timestamp()
         piper = self.piper
 
+        self.stop_ctrl_loop()
+
         enable_flag = False
-        loop_flag = False
         timeout = 5
         start_time = time.time()
-        elapsed_time_flag = False
 
-        while not (loop_flag):
+        while True:
             elapsed_time = time.time() - start_time
-            print(f"--------------------")
-            
-            enable_list = []
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_1.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_2.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_3.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_4.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_5.foc_status.driver_enable_status)
-            enable_list.append(piper.GetArmLowSpdInfoMsgs().motor_6.foc_status.driver_enable_status)
-
-            enable_flag = any(enable_list)
+
+            enable_flag = self.get_motor_enable_mask() != 0
 
             piper.DisableArm(7)
             piper.GripperCtrl(0, 1000, 0x02, 0)
-            
-            print(f"使能状态: {enable_flag}")
-            print(f"--------------------")
-            
-            if(enable_flag == False):
-                loop_flag = True
-                enable_flag = False
-            else: 
-                loop_flag = False
-                enable_flag = True
-            
+
+            if not enable_flag:
+                break
+
             if elapsed_time > timeout:
-                print(f"超时....")
-                elapsed_time_flag = True
-                enable_flag = True
-                loop_flag = True
+                LOG.warning("超时....")
                 break
-            time.sleep(0.5)
+            await asyncio.sleep(0.05)
 
         resp = enable_flag
-        print(f"Returning response: {resp}")
+        LOG.debug("Returning response: %s", resp)
 
         return resp
     
     def joint_ctrl(self, joints):
         self.record_timestamp()
+
+        # reject targets the int32 command cannot carry before they reach the loop:
+        # a NaN would stick in the smoothed state and go out as INT32_MIN forever
+        target = np.asarray(joints[:6], dtype=np.float64)
+        if (target.shape != (6,) or not np.all(np.isfinite(target))
+                or np.any(np.abs(target) > JOINT_CMD_MAX / 1000.0)):
+            raise ValueError(f"Joint targets must be 6 finite values within the int32 command range, got {joints!r}")
+
+        # only latch the target; the control loop streams smoothed
+        # intermediate commands to the arm at ctrl_rate
+        with self._ctrl_lock:
+            self._target[:] = target
+            self._ctrl_wake.set()
+
+        # (re)start the loop, also when it died on an error
+        if self._ctrl_thread is None or not self._ctrl_thread.is_alive():
+            self.start_ctrl_loop()
+
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug("freq: %.1f Hz", self.calculate_average_rate())
+
+    def start_ctrl_loop(self):
+        # seed from the measured pose so the first commands do not jump
+        status = self.get_joint_status()
+        self._current[:] = (status.joint_1, status.joint_2, status.joint_3,
+                            status.joint_4, status.joint_5, status.joint_6)
+        # 0.001 degree to degree
+        self._current /= 1000.0
+
+        # the arm may have been re-enabled since, so resend the motion mode
+        self._last_motion_ctrl = None
+        self._ctrl_stop.clear()
+        self._ctrl_thread = threading.Thread(target=self._ctrl_loop, name="piper-ctrl", daemon=True)
+        self._ctrl_thread.start()
+
+    def stop_ctrl_loop(self):
+        if self._ctrl_thread is None:
+            return
+        self._ctrl_stop.set()
+        self._ctrl_wake.set()
+        self._ctrl_thread.join()
+        self._ctrl_thread = None
+
+    def _ctrl_loop(self):
+        period = 1.0 / self.ctrl_rate
+        next_time = time.perf_counter()
+
+        while not self._ctrl_stop.is_set():
+            with self._ctrl_lock:
+                # current += alpha * (target - current)
+                np.subtract(self._target, self._current, out=self._step)
+                settled = np.max(np.abs(self._step)) < self.ctrl_tolerance
+                if settled:
+                    self._current[:] = self._target
+                    self._ctrl_wake.clear()
+            if not settled:
+                self._step *= self.ctrl_alpha
+                self._current += self._step
+
+            try:
+                self._send_joint_ctrl(self._current)
+            except Exception:
+                # keep the loop alive on SDK/CAN errors, and resend the mode next time
+                LOG.exception("Sending joint command failed")
+                self._last_motion_ctrl = None
+                settled = False
+
+            if settled:
+                # target reached and sent, idle until joint_ctrl or stop_ctrl_loop
+                self._ctrl_wake.wait()
+                next_time = time.perf_counter()
+                continue
+
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind, resync instead of bursting to catch up
+                next_time = time.perf_counter()
+
+    def _send_joint_ctrl(self, joints):
         piper = self.piper
 
-        # degree to radian
-        factor = 1000
+        # degree to 0.001 degree
+        factor = 1000.0
 
-        joint_0 = round(joints[0]*factor)
-        joint_1 = round(joints[1]*factor)
-        joint_2 = round(joints[2]*factor)
-        joint_3 = round(joints[3]*factor)
-        joint_4 = round(joints[4]*factor)
-        joint_5 = round(joints[5]*factor)
+        np.multiply(joints, factor, out=self._joint_scratch)
+        np.rint(self._joint_scratch, out=self._joint_scratch)
+        self._joint_int[:] = self._joint_scratch
 
         # joint_6 = round(position[6] * 1000 * 1000)
 
-        piper.MotionCtrl_2(0x01, 0x01, self.speed_ratio, 0x00)
-        piper.JointCtrl(joint_0, joint_1, joint_2, joint_3, joint_4, joint_5)
+        motion_ctrl = (0x01, 0x01, self.speed_ratio, 0x00)
+        if motion_ctrl != self._last_motion_ctrl:
+            piper.MotionCtrl_2(*motion_ctrl)
+            self._last_motion_ctrl = motion_ctrl
+        piper.JointCtrl(*self._joint_int.tolist())
         # piper.GripperCtrl(abs(joint_6), 1000, 0x01, 0)
-        piper.MotionCtrl_2(0x01, 0x01, self.speed_ratio, 0x00)
-
-        print(f"freq: {self.calculate_average_rate()} Hz")
 
 
     def get_joint_status(self):
@@ -261,9 +368,9 @@ if __name__ == "__main__":
     # print arm status
     print(f"Arm Status: \n{status}")
 
-    arm.enable()
+    asyncio.run(arm.enable())
     time.sleep(10)
-    arm.disable()
+    asyncio.run(arm.disable())
 
     # average_rate = arm.calculate_average_rate()
     # print(f"Average command sending rate: {average_rate} Hz")
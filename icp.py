@@ -1,67 +1,351 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+
 import numpy as np
-from scipy.linalg import svd
 from scipy.spatial import KDTree  # For efficient nearest neighbor search
 
-def standard_icp(source_points, target_points, max_iterations=100, tolerance=1e-6):
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional, the ICP step then runs as plain NumPy
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+try:
+    import cupy as cp
+except ImportError:  # cupy is optional, only needed for standard_icp(use_gpu=True)
+    cp = None
+
+# Above this many target points the KDTree beats the O(N^2) brute-force search
+# (measured crossover is around 64 points)
+BRUTE_FORCE_MAX_POINTS = 64
+
+
+def closest_points_brute_force(ref_xs, ref_ys, ref_zs, query_points):
+    """
+    Finds the nearest reference point for each query point by exhaustive search.
+
+    Args:
+        ref_xs, ref_ys, ref_zs: Contiguous (M,) arrays holding the reference point coordinates.
+        query_points: A numpy array of shape (N, 3).
+
+    Returns:
+        distances: The (N,) distances to the nearest reference points.
+        indices: The (N,) indices of the nearest reference points.
+    """
+    # Structure-of-arrays layout keeps each broadcast a contiguous, vectorizable stream
+    dx = query_points[:, 0, None] - ref_xs
+    dy = query_points[:, 1, None] - ref_ys
+    dz = query_points[:, 2, None] - ref_zs
+    squared_distances = dx * dx + dy * dy + dz * dz
+
+    indices = np.argmin(squared_distances, axis=1)
+    distances = np.sqrt(squared_distances[np.arange(len(indices)), indices])
+
+    return distances, indices
+
+
+# Upper bound on query x reference distances held on the GPU at once (128 MB of float64)
+GPU_BLOCK_ELEMENTS = 1 << 24
+
+
+def closest_points_gpu(ref_xs, ref_ys, ref_zs, query_points):
+    """
+    Finds the nearest reference point for each query point by exhaustive search on the GPU.
+
+    Same result as closest_points_brute_force; queries are processed in blocks so the
+    distance matrix never exceeds GPU_BLOCK_ELEMENTS entries.
+
+    Args:
+        ref_xs, ref_ys, ref_zs: CuPy (M,) arrays holding the reference point coordinates.
+        query_points: A numpy array of shape (N, 3).
+
+    Returns:
+        distances: The (N,) distances to the nearest reference points.
+        indices: The (N,) indices of the nearest reference points.
+    """
+    queries = cp.asarray(query_points)
+    num_queries = queries.shape[0]
+    block_size = max(1, GPU_BLOCK_ELEMENTS // ref_xs.shape[0])
+
+    indices = cp.empty(num_queries, dtype=cp.int64)
+    squared_distances = cp.empty(num_queries, dtype=cp.float64)
+    for start in range(0, num_queries, block_size):
+        block = queries[start:start + block_size]
+        dx = block[:, 0, None] - ref_xs
+        dy = block[:, 1, None] - ref_ys
+        dz = block[:, 2, None] - ref_zs
+        block_distances = dx * dx + dy * dy + dz * dz
+
+        block_indices = cp.argmin(block_distances, axis=1)
+        indices[start:start + block_size] = block_indices
+        squared_distances[start:start + block_size] = \
+            block_distances[cp.arange(block_indices.shape[0]), block_indices]
+
+    return cp.asnumpy(cp.sqrt(squared_distances)), cp.asnumpy(indices)
+
+
+@njit(cache=True)
+def rotation_from_covariance(covariance_matrix):
+    """
+    Computes the rotation maximizing trace(R @ covariance_matrix) with Horn's quaternion method.
+
+    Equivalent to the SVD solution with reflection correction: the optimal unit
+    quaternion is the eigenvector of the largest eigenvalue of a symmetric 4x4 matrix,
+    and a unit quaternion always yields a proper rotation.
+
+    Args:
+        covariance_matrix: The 3x3 cross-covariance matrix sum((source - c_s) @ (target - c_t).T).
+
+    Returns:
+        rotation: The 3x3 rotation matrix.
+    """
+    sxx, sxy, sxz = covariance_matrix[0, 0], covariance_matrix[0, 1], covariance_matrix[0, 2]
+    syx, syy, syz = covariance_matrix[1, 0], covariance_matrix[1, 1], covariance_matrix[1, 2]
+    szx, szy, szz = covariance_matrix[2, 0], covariance_matrix[2, 1], covariance_matrix[2, 2]
+
+    n = np.empty((4, 4))
+    n[0, 0] = sxx + syy + szz
+    n[0, 1] = n[1, 0] = syz - szy
+    n[0, 2] = n[2, 0] = szx - sxz
+    n[0, 3] = n[3, 0] = sxy - syx
+    n[1, 1] = sxx - syy - szz
+    n[1, 2] = n[2, 1] = sxy + syx
+    n[1, 3] = n[3, 1] = szx + sxz
+    n[2, 2] = -sxx + syy - szz
+    n[2, 3] = n[3, 2] = syz + szy
+    n[3, 3] = -sxx - syy + szz
+
+    # eigh sorts eigenvalues ascending, the last eigenvector is the optimal quaternion
+    eigenvalues, eigenvectors = np.linalg.eigh(n)
+    w, x, y, z = eigenvectors[0, 3], eigenvectors[1, 3], eigenvectors[2, 3], eigenvectors[3, 3]
+
+    rotation = np.empty((3, 3))
+    rotation[0, 0] = w * w + x * x - y * y - z * z
+    rotation[0, 1] = 2.0 * (x * y - w * z)
+    rotation[0, 2] = 2.0 * (x * z + w * y)
+    rotation[1, 0] = 2.0 * (x * y + w * z)
+    rotation[1, 1] = w * w - x * x + y * y - z * z
+    rotation[1, 2] = 2.0 * (y * z - w * x)
+    rotation[2, 0] = 2.0 * (x * z - w * y)
+    rotation[2, 1] = 2.0 * (y * z + w * x)
+    rotation[2, 2] = w * w - x * x - y * y + z * z
+
+    return rotation
+
+
+def _centered_covariance_numpy(source_points, closest_target_points, with_squared_norms=True):
+    num_points = source_points.shape[0]
+    source_centroid = (source_points.sum(axis=0) / num_points).reshape(3, 1)
+    target_centroid = (closest_target_points.sum(axis=0) / num_points).reshape(3, 1)
+
+    centered_source = source_points - source_centroid.T
+    centered_target = closest_target_points - target_centroid.T
+    covariance_matrix = centered_source.T @ centered_target
+    squared_norms = 0.0
+    if with_squared_norms:
+        squared_norms = np.sum(centered_source * centered_source) + np.sum(centered_target * centered_target)
+
+    return source_centroid, target_centroid, covariance_matrix, squared_norms
+
+
+@njit(cache=True)
+def _centered_covariance_loops(source_points, closest_target_points, with_squared_norms=True):
+    # Same result as the NumPy version, accumulated in two passes without the
+    # centered (N, 3) temporaries; centering on the fly avoids the cancellation
+    # of the one-pass sum(s t^T) - N c_s c_t^T form.
+    num_points = source_points.shape[0]
+    source_centroid = np.zeros((3, 1))
+    target_centroid = np.zeros((3, 1))
+    for j in range(num_points):
+        for i in range(3):
+            source_centroid[i, 0] += source_points[j, i]
+            target_centroid[i, 0] += closest_target_points[j, i]
+    source_centroid /= num_points
+    target_centroid /= num_points
+
+    covariance_matrix = np.zeros((3, 3))
+    squared_norms = 0.0
+    for j in range(num_points):
+        s0 = source_points[j, 0] - source_centroid[0, 0]
+        s1 = source_points[j, 1] - source_centroid[1, 0]
+        s2 = source_points[j, 2] - source_centroid[2, 0]
+        t0 = closest_target_points[j, 0] - target_centroid[0, 0]
+        t1 = closest_target_points[j, 1] - target_centroid[1, 0]
+        t2 = closest_target_points[j, 2] - target_centroid[2, 0]
+        covariance_matrix[0, 0] += s0 * t0
+        covariance_matrix[0, 1] += s0 * t1
+        covariance_matrix[0, 2] += s0 * t2
+        covariance_matrix[1, 0] += s1 * t0
+        covariance_matrix[1, 1] += s1 * t1
+        covariance_matrix[1, 2] += s1 * t2
+        covariance_matrix[2, 0] += s2 * t0
+        covariance_matrix[2, 1] += s2 * t1
+        covariance_matrix[2, 2] += s2 * t2
+        if with_squared_norms:
+            squared_norms += s0 * s0 + s1 * s1 + s2 * s2 + t0 * t0 + t1 * t1 + t2 * t2
+
+    return source_centroid, target_centroid, covariance_matrix, squared_norms
+
+
+# Explicit loops only pay off when compiled; interpreted, the vectorized form is far faster
+centered_covariance = _centered_covariance_loops if HAVE_NUMBA else _centered_covariance_numpy
+
+
+@njit(cache=True)
+def icp_step(source_points, closest_target_points, use_analytic_rotation=False, compute_residual=True):
+    """
+    Solves one ICP iteration (Kabsch) for already matched point pairs.
+
+    Compiled with numba when it is installed, so the centroid, covariance and
+    SVD steps run without interpreter overhead or NumPy dispatch per call.
+
+    Args:
+        source_points: A numpy array of shape (N, 3).
+        closest_target_points: A numpy array of shape (N, 3), matched row-wise to source_points.
+        use_analytic_rotation: Solve the rotation with Horn's quaternion method
+            (rotation_from_covariance) instead of the 3x3 SVD.
+        compute_residual: Accumulate the squared norms needed for mse; when False,
+            mse is returned as NaN.
+
+    Returns:
+        rotation: The 3x3 rotation matrix.
+        translation: The (3, 1) translation vector.
+        mse: The mean squared distance between the source points and the aligned matches.
+    """
+    num_points = source_points.shape[0]
+
+    # 2.-3. Calculate Centroids and Covariance Matrix
+    source_centroid, target_centroid, covariance_matrix, squared_norms = \
+        centered_covariance(source_points, closest_target_points, compute_residual)
+
+    if use_analytic_rotation:
+        # 4.-5. Closed-form rotation, never a reflection
+        rotation = rotation_from_covariance(covariance_matrix)
+    else:
+        # 4. Singular Value Decomposition (SVD)
+        U, S, Vt = np.linalg.svd(covariance_matrix)
+
+        # 5. Calculate Rotation
+        rotation = Vt.T @ U.T
+
+        # Check for reflection: negating the last column of V only changes V @ U.T
+        # by the rank-1 term -2 v3 u3^T, so correct in place instead of rebuilding
+        if np.linalg.det(rotation) < 0:
+            rotation -= 2.0 * np.outer(Vt[2], U[:, 2])
+
+    # 6. Calculate Translation
+    translation = source_centroid - rotation @ target_centroid
+
+    # Residual of the aligned pairs without forming them: with this translation,
+    # sum|s - (R t + T)|^2 = sum|s'|^2 + sum|t'|^2 - 2 sum(R * H) for centered s', t'
+    mse = np.nan
+    if compute_residual:
+        mse = max((squared_norms - 2.0 * np.sum(rotation * covariance_matrix)) / num_points, 0.0)
+
+    return rotation, translation, mse
+
+
+def standard_icp(source_points, target_points, max_iterations=100, tolerance=1e-6,
+                 rel_tolerance=None, patience=3, target_tree=None, use_gpu=False,
+                 use_analytic_rotation=False, return_iterations=False):
     """
     Performs standard Iterative Closest Point (ICP) registration (rigid body).
 
+    Stops as soon as the correspondences repeat, since the next transform would be identical.
+
     Args:
         source_points: A numpy array of shape (N, 3) representing the source point cloud.
         target_points: A numpy array of shape (N, 3) representing the target point cloud.
         max_iterations: The maximum number of iterations.
         tolerance: The convergence tolerance (change in rotation and translation).
+        rel_tolerance: Optional relative tolerance on the change of the mean squared residual;
+            stop once it stays below this for `patience` consecutive iterations.
+        patience: Number of consecutive iterations checked against rel_tolerance.
+        target_tree: Optional KDTree already built on target_points, to reuse it across
+            calls with the same target cloud instead of rebuilding it.
+        use_gpu: Run the closest point search on the GPU with CuPy, for large clouds
+            where the search dominates. The 3x3 solve stays on the host.
+        use_analytic_rotation: Solve the rotation with Horn's quaternion method instead of
+            the SVD. Faster, but when the optimum is not unique (symmetric point sets) it may
+            pick a different optimal rotation than the SVD, so the SVD stays the default.
+        return_iterations: Also return the number of iterations that solved a transform.
 
     Returns:
         transform: A 4x4 numpy array representing the rigid transformation matrix (T_B_to_S).
         rotation: The 3x3 rotation matrix.
         translation: The 3-element translation vector.
+        iterations: The number of solved iterations, only when return_iterations is True.
     """
 
     # Check input
     if source_points.shape[0] != target_points.shape[0] or source_points.shape[0] < 3:
         raise ValueError("Point sets must have the same size and at least 3 points.")
 
+    # One dtype and memory layout for every call: int or strided inputs would otherwise
+    # be copied inside the KDTree and compile extra numba specializations of icp_step.
+    # float64 is kept since cKDTree computes in double anyway and the 3x3 solve needs it.
+    # Everything stays in the (N, 3) row layout the KDTree expects, so no per-iteration
+    # transposed views have to be copied back to C order.
+    source_points = np.ascontiguousarray(source_points, dtype=np.float64)
+    target_points = np.ascontiguousarray(target_points, dtype=np.float64)
+
     num_points = source_points.shape[0]
-    source_points = source_points.T  # Make them 3xN
-    target_points = target_points.T
 
-    # Build KDTree for target points (for efficient nearest neighbor search)
-    target_tree = KDTree(target_points.T)
+    # Build KDTree for target points (for efficient nearest neighbor search);
+    # small clouds are searched exhaustively, which avoids the tree's per-query overhead
+    if use_gpu:
+        if cp is None:
+            raise ImportError("standard_icp(use_gpu=True) requires cupy.")
+        target_tree = None
+        target_xs = cp.asarray(target_points[:, 0])
+        target_ys = cp.asarray(target_points[:, 1])
+        target_zs = cp.asarray(target_points[:, 2])
+    elif target_tree is None and num_points > BRUTE_FORCE_MAX_POINTS:
+        target_tree = KDTree(target_points)
+    elif target_tree is None:
+        target_xs = np.ascontiguousarray(target_points[:, 0])
+        target_ys = np.ascontiguousarray(target_points[:, 1])
+        target_zs = np.ascontiguousarray(target_points[:, 2])
 
     # Initialize transformation
     rotation = np.eye(3)
     translation = np.zeros((3, 1))
     transform = np.eye(4)
 
+    previous_indices = None
+    previous_residual = None
+    plateau_count = 0
+    iterations = 0
+
     for iteration in range(max_iterations):
         # 1. Find Closest Points (using KDTree)
-        transformed_target = rotation @ target_points + translation
-        distances, closest_indices = target_tree.query(transformed_target.T) #query need (N,3)
-        closest_indices = closest_indices.tolist()
-
-
-        # 2. Calculate Centroids
-        source_centroid = np.mean(source_points, axis=1, keepdims=True)
-        target_centroid = np.mean(target_points[:, closest_indices], axis=1, keepdims=True)
-
-        # 3. Calculate Covariance Matrix
-        covariance_matrix = (source_points - source_centroid) @ (target_points[:, closest_indices] - target_centroid).T
-
-        # 4. Singular Value Decomposition (SVD)
-        U, S, Vt = svd(covariance_matrix)
-
-        # 5. Calculate Rotation
-        V = Vt.T
-        new_rotation = V @ U.T
+        transformed_target = target_points @ rotation.T + translation.T
+        if target_tree is not None:
+            distances, closest_indices = target_tree.query(transformed_target)
+        elif use_gpu:
+            distances, closest_indices = closest_points_gpu(
+                target_xs, target_ys, target_zs, transformed_target)
+        else:
+            distances, closest_indices = closest_points_brute_force(
+                target_xs, target_ys, target_zs, transformed_target)
+
+        # Same correspondences give the same transform, so it has converged
+        if previous_indices is not None and np.array_equal(closest_indices, previous_indices):
+            break
+        previous_indices = closest_indices
 
-        # Check for reflection
-        if np.linalg.det(new_rotation) < 0:
-            V[:, 2] *= -1
-            new_rotation = V @ U.T
+        # gather the matched points once with a vectorized fancy index
+        closest_target_points = target_points[closest_indices]
 
-        # 6. Calculate Translation
-        new_translation = source_centroid - new_rotation @ target_centroid
+        # 2.-6. Solve for the rigid transform of the matched pairs
+        new_rotation, new_translation, residual = icp_step(
+            source_points, closest_target_points, use_analytic_rotation, rel_tolerance is not None)
+        iterations += 1
 
         # Check for convergence
         rotation_change = np.linalg.norm(new_rotation - rotation)
@@ -73,13 +357,147 @@ def standard_icp(source_points, target_points, max_iterations=100, tolerance=1e-
         if rotation_change < tolerance and translation_change < tolerance:
             break
 
+        if rel_tolerance is not None:
+            if previous_residual is not None and \
+                    abs(previous_residual - residual) <= rel_tolerance * (previous_residual + 1e-12):
+                plateau_count += 1
+                if plateau_count >= patience:
+                    break
+            else:
+                plateau_count = 0
+            previous_residual = residual
+
     # Construct the 4x4 transformation matrix
     transform[:3, :3] = rotation
     transform[:3, 3] = translation.flatten()
 
+    if return_iterations:
+        return transform, rotation, translation, iterations
     return transform, rotation, translation
 
 
+def standard_icp_many(point_cloud_pairs, max_workers=None, **icp_kwargs):
+    """
+    Runs standard_icp on independent (source_points, target_points) pairs in a process pool.
+
+    Each registration is independent, so they scale across cores. Worth it for many
+    or large clouds; for a handful of small clouds the process start-up dominates.
+
+    Args:
+        point_cloud_pairs: An iterable of (source_points, target_points) tuples of (N, 3) arrays.
+        max_workers: The number of worker processes (defaults to the CPU count).
+        **icp_kwargs: Keyword arguments passed on to standard_icp.
+
+    Returns:
+        A list with the (transform, rotation, translation) result of each pair, in input order.
+    """
+    run_pair = functools.partial(_standard_icp_pair, **icp_kwargs)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_pair, point_cloud_pairs))
+
+
+def batched_icp(source_batch, target_points, max_iterations=100, tolerance=1e-6):
+    """
+    Performs standard_icp for a batch of source clouds against one target cloud at once.
+
+    Every step is vectorized over the batch (stacked brute-force distances, stacked 3x3
+    SVDs), so Python and LAPACK dispatch is paid once per iteration instead of once per
+    cloud. Clouds that converge are frozen while the rest keep iterating. Holds a
+    (B, N, N) distance array, so it is meant for many small clouds.
+
+    Args:
+        source_batch: A numpy array of shape (B, N, 3) holding B source point clouds.
+        target_points: A numpy array of shape (N, 3) representing the target point cloud.
+        max_iterations: The maximum number of iterations.
+        tolerance: The convergence tolerance (change in rotation and translation).
+
+    Returns:
+        transforms: A (B, 4, 4) array of rigid transformation matrices.
+        rotations: A (B, 3, 3) array of rotation matrices.
+        translations: A (B, 3, 1) array of translation vectors.
+    """
+    source_batch = np.ascontiguousarray(source_batch, dtype=np.float64)
+    target_points = np.ascontiguousarray(target_points, dtype=np.float64)
+
+    # Check input
+    if source_batch.ndim != 3 or source_batch.shape[1:] != target_points.shape or target_points.shape[0] < 3:
+        raise ValueError("Point sets must have the same size and at least 3 points.")
+
+    batch_size, num_points = source_batch.shape[:2]
+
+    rotations = np.tile(np.eye(3), (batch_size, 1, 1))
+    translations = np.zeros((batch_size, 3, 1))
+    previous_indices = np.full((batch_size, num_points), -1)
+    active = np.arange(batch_size)
+
+    for iteration in range(max_iterations):
+        if active.size == 0:
+            break
+        rotation = rotations[active]
+        translation = translations[active]
+
+        # 1. Find Closest Points (brute force over the stacked clouds)
+        transformed_target = target_points @ rotation.transpose(0, 2, 1) + translation.transpose(0, 2, 1)
+        dx = transformed_target[:, :, 0, None] - target_points[:, 0]
+        dy = transformed_target[:, :, 1, None] - target_points[:, 1]
+        dz = transformed_target[:, :, 2, None] - target_points[:, 2]
+        closest_indices = np.argmin(dx * dx + dy * dy + dz * dz, axis=2)
+
+        # Same correspondences give the same transform, so those clouds have converged
+        changed = np.any(closest_indices != previous_indices[active], axis=1)
+        previous_indices[active] = closest_indices
+        active = active[changed]
+        if active.size == 0:
+            break
+        rotation = rotation[changed]
+        translation = translation[changed]
+        closest_indices = closest_indices[changed]
+
+        # 2. Calculate Centroids
+        src = source_batch[active]
+        closest_target_points = target_points[closest_indices]
+        source_centroid = np.mean(src, axis=1, keepdims=True)
+        target_centroid = np.mean(closest_target_points, axis=1, keepdims=True)
+
+        # 3. Calculate Covariance Matrix
+        covariance_matrix = (src - source_centroid).transpose(0, 2, 1) @ (closest_target_points - target_centroid)
+
+        # 4. Singular Value Decomposition (SVD), stacked
+        U, S, Vt = np.linalg.svd(covariance_matrix)
+
+        # 5. Calculate Rotation
+        new_rotation = Vt.transpose(0, 2, 1) @ U.transpose(0, 2, 1)
+
+        # Check for reflection (same rank-1 correction as icp_step)
+        reflected = np.linalg.det(new_rotation) < 0
+        if np.any(reflected):
+            new_rotation[reflected] -= 2.0 * Vt[reflected, 2, :, None] * U[reflected, None, :, 2]
+
+        # 6. Calculate Translation
+        new_translation = (source_centroid - target_centroid @ new_rotation.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+        # Check for convergence
+        rotation_change = np.linalg.norm(new_rotation - rotation, axis=(1, 2))
+        translation_change = np.linalg.norm(new_translation - translation, axis=(1, 2))
+
+        rotations[active] = new_rotation
+        translations[active] = new_translation
+
+        active = active[(rotation_change >= tolerance) | (translation_change >= tolerance)]
+
+    # Construct the 4x4 transformation matrices
+    transforms = np.tile(np.eye(4), (batch_size, 1, 1))
+    transforms[:, :3, :3] = rotations
+    transforms[:, :3, 3] = translations[:, :, 0]
+
+    return transforms, rotations, translations
+
+
+def _standard_icp_pair(point_cloud_pair, **icp_kwargs):
+    source_points, target_points = point_cloud_pair
+    return standard_icp(source_points, target_points, **icp_kwargs)
+
+
 def estimate_scale(source_points, target_points, transformation_matrix):
     """
     Estimates the scale factor after applying a rigid transformation.
@@ -1,4 +1,8 @@
+import logging
 import serial
+import queue
+import struct
+import threading
 import time
 import asyncio
 
@@ -19,63 +23,120 @@ regdict = {
     'actionRun' : 2322
 }
 
+LOG = logging.getLogger(__name__)
+
+# frame header: 0xEB 0x90, id, len, cmd, little-endian register address
+FRAME_HEADER = struct.Struct('<BBBBBH')
+# reply to a register write: header, status byte and checksum
+WRITE_REPLY_LEN = 9
+# register values: 6 bytes / 6 little-endian u16, for read replies and writes
+READ6_VALUES = struct.Struct('<6B')
+SIX_U16_VALUES = struct.Struct('<6H')
+
+# port -> lock; hands on the same bus share one lock so their frames never interleave,
+# hands on separate ports do not wait for each other
+_PORT_LOCKS = {}
+
+
+# -1 in a setter's values means "leave this finger unchanged", sent as 0xFFFF
+NO_CHANGE = -1
+
+
+def _pack_u16le(vals):
+    regs = vals
+    if NO_CHANGE in regs:
+        regs = [0xFFFF if v == NO_CHANGE else v for v in regs]
+    try:
+        return SIX_U16_VALUES.pack(*regs)
+    except struct.error:
+        raise ValueError(f"Expected 6 register values in 0..65535 or {NO_CHANGE}, got {vals!r}") from None
+
 
 class InspireHand:
     def __init__(self, port, baudrate):
         self.ser = self.open_serial(port, baudrate)
 
+        # writes are queued and sent by one thread, so callers never block on the port;
+        # each queued item is a tuple of frames sent together under the bus lock
+        self._tx_queue = queue.Queue()
+        # first write error not yet reported to a caller, raised by flush()
+        self._tx_error = None
+        self._io_lock = _PORT_LOCKS.setdefault(port, threading.Lock())
+        self._tx_thread = threading.Thread(target=self._tx_loop, daemon=True)
+        self._tx_thread.start()
+
     def open_serial(self, port, baudrate):
         ser = serial.Serial()
         ser.port = port
         ser.baudrate = baudrate
+        # read() waits for the expected reply bytes, but never longer than this
+        ser.timeout = 0.05
         ser.open()
+        # USB serial adapters otherwise hold small reads back for their latency timer (~16 ms)
+        try:
+            ser.set_low_latency_mode(True)
+        except (AttributeError, OSError, ValueError):
+            pass  # not Linux, or the driver does not support it
         return ser
 
+    def build_write_frame(self, id, addr, num, val):
+        frame = FRAME_HEADER.pack(0xEB, 0x90, id, num + 3, 0x12, addr) + bytes(val[:num])
+        checksum = sum(frame[2:]) & 0xFF
+        return frame + bytes((checksum,))
+
     def write_register(self, id, addr, num, val):
-        bytes = [0xEB, 0x90]
-        bytes.append(id)  # id
-        bytes.append(num + 3)  # len
-        bytes.append(0x12)  # cmd
-        bytes.append(addr & 0xFF)
-        bytes.append((addr >> 8) & 0xFF)  # add
-        for i in range(num):
-            bytes.append(val[i])
-        checksum = 0x00
-        for i in range(2, len(bytes)):
-            checksum += bytes[i]
-        checksum &= 0xFF
-        bytes.append(checksum)
-        self.ser.write(bytes)
-
-        time.sleep(0.01)
-
-        self.ser.read_all()  # 把返回帧读掉，不处理
+        self._tx_queue.put((self.build_write_frame(id, addr, num, val),))
+
+    def flush(self):
+        # Wait until every queued frame is sent and acknowledged, then raise
+        # the first write error the sender thread hit since the last flush
+        self._tx_queue.join()
+
+        error, self._tx_error = self._tx_error, None
+        if error is not None:
+            raise error
+
+    def _tx_loop(self):
+        while True:
+            frames = self._tx_queue.get()
+            try:
+                with self._io_lock:
+                    # RS485 is half duplex: send one frame, then wait for its reply
+                    # before the next one so the request never collides with the reply
+                    for frame in frames:
+                        self.ser.write(frame)
+                        self.ser.read(WRITE_REPLY_LEN)  # reply is read and discarded
+            except Exception as e:
+                # keep the sender alive whatever failed; flush() reports the error
+                LOG.exception("InspireHand write failed")
+                if self._tx_error is None:
+                    self._tx_error = e
+            finally:
+                self._tx_queue.task_done()
+
+    def read_frame(self, id, addr, num):
+        # returns the raw reply frame, the register values start at byte 7
+        frame = FRAME_HEADER.pack(0xEB, 0x90, id, 0x04, 0x11, addr) + bytes((num,))
+        checksum = sum(frame[2:]) & 0xFF
+        # read after the writes queued so far, as when they were sent inline
+        self.flush()
+        with self._io_lock:
+            # drop a reply that arrived only after an earlier read timed out
+            self.ser.reset_input_buffer()
+            self.ser.write(frame + bytes((checksum,)))
+
+            # reply: 7 header bytes, num register bytes and the checksum; returns once complete
+            recv = self.ser.read(8 + num)
+
+        return recv
 
     def read_register(self, id, addr, num, verbose=False):
-        bytes = [0xEB, 0x90]
-        bytes.append(id)  # id
-        bytes.append(0x04)  # len
-        bytes.append(0x11)  # cmd
-        bytes.append(addr & 0xFF)
-        bytes.append((addr >> 8) & 0xFF)  # add
-        bytes.append(num)
-        checksum = 0x00
-        for i in range(2, len(bytes)):
-            checksum += bytes[i]
-        checksum &= 0xFF
-        bytes.append(checksum)
-        self.ser.write(bytes)
-
-        time.sleep(0.01)
-
-        recv = self.ser.read_all()
+        recv = self.read_frame(id, addr, num)
 
         if len(recv) == 0:
             return []
         num = (recv[3] & 0xFF) - 3
-        val = []
-        for i in range(num):
-            val.append(recv[7 + i])
+        val = list(recv[7:7 + num])
 
         if verbose:
             print('读到的寄存器值依次为：', end='')
@@ -99,68 +160,50 @@ class InspireHand:
         if str not in regdict:
             print(f"Incorrect command.")
             return
-        len = 6
         # str == 'errCode' or str == 'statusCode' or str == 'temp':
-        val_act = self.read_register(id, regdict[str], len, True)
-        if len(val_act) < len:
+        recv = self.read_frame(id, regdict[str], 6)
+        if len(recv) < 8 + 6:
             print('没有读到数据')
             return
-        print('读到的值依次为：', end='')
-        for i in range(len):
-            print(val_act[i], end=' ')
-        print()
+        val_act = READ6_VALUES.unpack_from(recv, 7)
+        print('读到的值依次为：', *val_act)
+        return val_act
 
     def read12(self, id, str):
         if str not in regdict:
             print(f"Incorrect command.")
             return
         
-        len = 12
         # if str == 'angleSet' or str == 'forceSet' or str == 'speedSet' or str == 'angleAct' or str == 'forceAct':
-        val = self.read_register(id, regdict[str], len, True)
-        if len(val) < len:
+        recv = self.read_frame(id, regdict[str], 12)
+        if len(recv) < 8 + 12:
             print('没有读到数据')
             return
-        val_act = []
-        for i in range(len / 2):
-            val_act.append((val[2*i] & 0xFF) + (val[1 + 2*i] << 8))
-        print('读到的值依次为：', end='')
-
-        for i in range(len / 2):
-            print(val_act[i], end=' ')
-        print()
+        val_act = SIX_U16_VALUES.unpack_from(recv, 7)
+        print('读到的值依次为：', *val_act)
+        return val_act
 
     def set_angle(self, hand_id, angles):
-        val_reg = []
-        for angle in angles:
-            val_reg.append(angle & 0xFF)
-            val_reg.append((angle >> 8) & 0xFF)
-
-        self.write_register(hand_id, regdict['angleSet'], 12, val_reg)
+        self.write_register(hand_id, regdict['angleSet'], 12, _pack_u16le(angles))
 
     def set_pos(self, hand_id, positions):
-        val_reg = []
-        for pos in positions:
-            val_reg.append(pos & 0xFF)
-            val_reg.append((pos >> 8) & 0xFF)
-
-        self.write_register(hand_id, regdict['angleSet'], 12, val_reg)
+        self.write_register(hand_id, regdict['angleSet'], 12, _pack_u16le(positions))
 
     def set_speed(self, hand_id, speeds):
-        val_reg = []
-        for speed in speeds:
-            val_reg.append(speed & 0xFF)
-            val_reg.append((speed >> 8) & 0xFF)
-
-        self.write_register(hand_id, regdict['speedSet'], 12, val_reg)
+        self.write_register(hand_id, regdict['speedSet'], 12, _pack_u16le(speeds))
 
     def set_force(self, hand_id, forces):
-        val_reg = []
-        for force in forces:
-            val_reg.append(force & 0xFF)
-            val_reg.append((force >> 8) & 0xFF)
-
-        self.write_register(hand_id, regdict['forceSet'], 12, val_reg)
+        self.write_register(hand_id, regdict['forceSet'], 12, _pack_u16le(forces))
+
+    def set_all(self, hand_id, angles, speeds, forces):
+        # angleSet (1486..1497) and forceSet (1498..1509) are contiguous, so one
+        # 24-byte write sets both in a single transaction; speed goes first so it
+        # already applies to the new angle target, and both frames are queued as
+        # one item so no other frame on the bus gets between them
+        self._tx_queue.put((
+            self.build_write_frame(hand_id, regdict['speedSet'], 12, _pack_u16le(speeds)),
+            self.build_write_frame(hand_id, regdict['angleSet'], 24, _pack_u16le(angles) + _pack_u16le(forces)),
+        ))
 
     # def set_wristangle(self, hand_id, yaw, pitch):
     #     val_reg = [
@@ -253,5 +296,6 @@ if __name__ == '__main__':
     time.sleep(1)
     print('运行灵巧手当前序列动作！')
     hand_api.write_register(1, regdict['actionRun'], 1, [1])
+    hand_api.flush()
     # hand_api.write_register(1, regdict['forceClb'], 1, [1])
     # time.sleep(10) # 由于力校准时间较长，请不要漏过这个sleep并尝试重新与手通讯，可能导致插件崩溃
@@ -1,11 +1,12 @@
+import inspect
 import json
+import logging
 import math
 import socket
 import time
 import pydantic
-from piper_sdk import *
 import asyncio
-from typing import Literal, Optional, Union
+from typing import AsyncIterator, Literal, Optional, Union
 
 from arm_control import BaseArm, PiperArm, PiperArmStatus, PiperJointStatus
 # from pydantic.dataclasses import dataclass
@@ -13,6 +14,8 @@ from pydantic import BaseModel
 
 from inspire_hand import InspireHand
 
+LOG = logging.getLogger(__name__)
+
 
 class BaseRequest(BaseModel):
     pass
@@ -42,6 +45,14 @@ class ArmGetJointStatusRequest(BaseModel):
     arm_side: Literal["left", "right"]
     arm_type: Literal["piper", "nova"]
 
+class ArmWatchJointStatusRequest(BaseModel):
+    command: str = "arm_watch_joint_status"
+    arm_side: Literal["left", "right"]
+    arm_type: Literal["piper", "nova"]
+    rate_hz: float = pydantic.Field(default=100.0, gt=0)
+    # number of updates to send, 0 streams until the client disconnects
+    count: int = pydantic.Field(default=0, ge=0)
+
 class ArmSetJointAnglesRequest(BaseModel):
     command: str = "arm_set_joint_angles"
     arm_side: Literal["left", "right"]
@@ -79,13 +90,19 @@ class DexHandManager:
 
     test_mode: bool = False
 
-    def __init__(self, arm_type="piper", hand_type="inspire", test_mode=False):
+    def __init__(self, arm_type="piper", hand_type="inspire", test_mode=False,
+                 left_can_name="can_left", right_can_name="can_right"):
         self.test_mode = test_mode
 
         if not self.test_mode:
+            # each arm needs its own CAN interface; PiperArm.get_or_create shares
+            # one instance per name, so equal names would drive a single arm twice
+            if left_can_name == right_can_name:
+                raise ValueError(f"Left and right arms must use different CAN interfaces, got {left_can_name!r} for both")
+
             if arm_type == "piper":
-                self.arm_left = PiperArm()
-                self.arm_right = PiperArm()
+                self.arm_left = PiperArm.get_or_create(left_can_name)
+                self.arm_right = PiperArm.get_or_create(right_can_name)
             else:
                 print(f"Unsupported arm type: {arm_type}")
 
@@ -95,8 +112,9 @@ class DexHandManager:
             except Exception as e:
                 print(f"Failed to connect to arm: {e}")
         else:
+            # test mode drives a single arm, as the right arm
             if arm_type == "piper":
-                self.arm_right = PiperArm()
+                self.arm_right = PiperArm.get_or_create(right_can_name)
             else:
                 print(f"Unsupported arm type: {arm_type}")
 
@@ -105,25 +123,23 @@ class DexHandManager:
             except Exception as e:
                 print(f"Failed to connect to arm: {e}")
 
-    def arm_enable(self, request: ArmEnableRequest):
+    async def arm_enable(self, request: ArmEnableRequest):
         if self.test_mode:
-            self.arm_right.enable()
+            await self.arm_right.enable()
 
             return BoolResponse(command=request.command, response=True)
         else:
-            self.arm_left.enable()
-            self.arm_right.enable()
+            await asyncio.gather(self.arm_left.enable(), self.arm_right.enable())
 
             return BoolResponse(command=request.command, response=True)
     
-    def arm_disable(self, request: ArmDisableRequest):
+    async def arm_disable(self, request: ArmDisableRequest):
         if self.test_mode:
-            self.arm_right.disable()
+            await self.arm_right.disable()
 
             return BoolResponse(command=request.command, response=True)
         else:
-            self.arm_left.disable()
-            self.arm_right.disable()
+            await asyncio.gather(self.arm_left.disable(), self.arm_right.disable())
 
             return BoolResponse(command=request.command, response=True)
     
@@ -133,15 +149,15 @@ class DexHandManager:
                 # assert the arm is a PiperArm
                 assert isinstance(self.arm_right, PiperArm)
                 joint_status = self.arm_right.get_joint_status()
-                data = {
-                    "command": request.command,
-                    "arm_side": request.arm_side,
-                    "arm_type": request.arm_type,
-                    "response": True,
-                    "joint_status": joint_status
-
-                }
-                return ArmGetJointStatusResponse(**data)
+                # every field is already validated (request) or typed (SDK),
+                # so skip re-validating the response on this hot path
+                return ArmGetJointStatusResponse.model_construct(
+                    command=request.command,
+                    arm_side=request.arm_side,
+                    arm_type=request.arm_type,
+                    response=True,
+                    joint_status=joint_status,
+                )
 
         # if (request.arm_side == "left"):
         #     if (request.arm_type == "piper"):
@@ -160,6 +176,49 @@ class DexHandManager:
 
 
 
+    async def arm_watch_joint_status(self, request: ArmWatchJointStatusRequest):
+        if self.test_mode:
+            if (request.arm_type == "piper"):
+                # assert the arm is a PiperArm
+                assert isinstance(self.arm_right, PiperArm)
+                loop = asyncio.get_running_loop()
+                period = 1.0 / request.rate_hz
+                next_time = loop.time()
+                sent = 0
+
+                # one response reused for every update: handle_client serializes each
+                # update before asking for the next one
+                update = ArmGetJointStatusResponse.model_construct(
+                    command=request.command,
+                    arm_side=request.arm_side,
+                    arm_type=request.arm_type,
+                    response=True,
+                    joint_status=None,
+                )
+
+                while True:
+                    update.joint_status = self.arm_right.get_joint_status()
+                    yield update
+                    sent += 1
+                    # count == 0 streams until the client goes away; otherwise stop
+                    # right after the last record instead of sleeping one more period
+                    if sent == request.count:
+                        return
+
+                    # fixed-rate schedule so slow writes do not accumulate drift
+                    next_time += period
+                    await asyncio.sleep(max(0.0, next_time - loop.time()))
+
+        # nothing to stream for this arm: one negative record ends the stream,
+        # so the client is not left waiting for a first line
+        yield ArmGetJointStatusResponse(
+            command=request.command,
+            arm_side=request.arm_side,
+            arm_type=request.arm_type,
+            response=False,
+            joint_status=None,
+        )
+
     def arm_get_arm_status(self, request: ArmGetArmStatusRequest):
         if self.test_mode:
             if (request.arm_type == "piper"):
@@ -188,7 +247,8 @@ class DexHandManager:
 
 
 
-MANAGER = DexHandManager(test_mode=True)
+# single test arm on the default interface
+MANAGER = DexHandManager(test_mode=True, right_can_name="can0")
 
 def start_tcp_server_sync():
     server_ip = "0.0.0.0"
@@ -222,32 +282,34 @@ def start_tcp_server_sync():
         client.close()
 
 
-def handle_message(message: str) -> BoolResponse:
+# command name -> (request model, DexHandManager handler)
+COMMAND_HANDLERS = {
+    "arm_enable": (ArmEnableRequest, DexHandManager.arm_enable),
+    "arm_disable": (ArmDisableRequest, DexHandManager.arm_disable),
+    "arm_get_arm_status": (ArmGetArmStatusRequest, DexHandManager.arm_get_arm_status),
+    "arm_get_joint_status": (ArmGetJointStatusRequest, DexHandManager.arm_get_joint_status),
+    # returns an async generator, streamed by handle_client
+    "arm_watch_joint_status": (ArmWatchJointStatusRequest, DexHandManager.arm_watch_joint_status),
+    "arm_set_joint_angles": (ArmSetJointAnglesRequest, DexHandManager.arm_set_joint_angles),
+}
+
+
+async def handle_message(message: str) -> Union[BaseModel, AsyncIterator[BaseModel]]:
     json_data = json.loads(message)
     cmd = json_data["command"]
-    
-    if cmd == "arm_enable":
-        request = ArmEnableRequest.model_validate_json(message)
-        response = MANAGER.arm_enable(request)
-    elif cmd == "arm_disable":
-        request = ArmDisableRequest.model_validate_json(message)
-        response = MANAGER.arm_disable(request)
-
-    elif cmd == "arm_get_arm_status":
-        request = ArmGetArmStatusRequest.model_validate_json(message)
-        response = MANAGER.arm_get_arm_status(request)
-
-    elif cmd == "arm_get_joint_status":
-        request = ArmGetJointStatusRequest.model_validate_json(message)
-        response = MANAGER.arm_get_joint_status(request)
-
-    elif cmd == "arm_set_joint_angles":
-        request = ArmSetJointAnglesRequest.model_validate_json(message)
-        response = MANAGER.arm_set_joint_angles(request)
+
+    handler = COMMAND_HANDLERS.get(cmd)
+    if handler is not None:
+        request_type, method = handler
+        # validate the already decoded payload instead of parsing the JSON again
+        request = request_type.model_validate(json_data)
+        response = method(MANAGER, request)
+        if inspect.isawaitable(response):
+            response = await response
     else:
         response = BoolResponse(command=cmd, response=False)
 
-    print(f"Response: {response}")
+    LOG.debug("Response: %s", response)
 
     return response
 
@@ -268,37 +330,46 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
                 break
 
             raw_json = data.decode(encoding="utf-8")
-            print(f"Received: {raw_json}")
+            LOG.debug("Received: %s", raw_json)
             
             # test_data = TestData.from_json(raw_json)
-            response = handle_message(raw_json)
+            response = await handle_message(raw_json)
 
-            writer.write(response.model_dump_json().encode(encoding="utf-8"))
-            await writer.drain()
+            if isinstance(response, BaseModel):
+                writer.write(response.model_dump_json().encode(encoding="utf-8"))
+                await writer.drain()
+            else:
+                # streamed updates are newline-delimited JSON on the same connection;
+                # drain() applies back-pressure when the client reads slowly
+                async for update in response:
+                    writer.write(update.model_dump_json().encode(encoding="utf-8") + b"\n")
+                    await writer.drain()
     except asyncio.CancelledError:
         pass
+    except ConnectionError:
+        LOG.info("Connection lost from %s", addr)
     finally:
         print(f"Disconnected by {addr}")
         writer.close()
         await writer.wait_closed()
 
 
-def start_tcp_server(host='0.0.0.0', port=8765):
-    event_loop = asyncio.get_event_loop()
+async def serve(host='0.0.0.0', port=8765):
+    server = await asyncio.start_server(handle_client, host, port)
+    async with server:
+        await server.serve_forever()
 
-    factory = asyncio.start_server(handle_client, host, port)
-    server = event_loop.run_until_complete(factory)
 
+def start_tcp_server(host='0.0.0.0', port=8765):
+    # asyncio.run creates, shuts down (async generators included) and closes the loop
     try:
-        event_loop.run_forever()
+        asyncio.run(serve(host, port))
     except KeyboardInterrupt:
         pass
     finally:
-        server.close()
-        event_loop.run_until_complete(server.wait_closed())
         print('closing event loop')
-        event_loop.close()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     start_tcp_server()
@@ -0,0 +1,145 @@
+import asyncio
+import sys
+import threading
+import time
+import types
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+
+class FakePiper:
+    """Records the frames PiperArm sends instead of talking to a CAN bus."""
+
+    ArmJoint = ArmStatus = object
+
+    def __init__(self, can_name="can0"):
+        self.lock = threading.Lock()
+        self.joint_ctrl = []
+        self.motion_ctrl = []
+        self.enabled = 0
+        self.fail_joint_ctrl = 0
+
+    def ConnectPort(self):
+        pass
+
+    def MotionCtrl_2(self, *args):
+        with self.lock:
+            self.motion_ctrl.append(args)
+
+    def JointCtrl(self, *joints):
+        with self.lock:
+            if self.fail_joint_ctrl:
+                self.fail_joint_ctrl -= 1
+                raise RuntimeError("injected CAN error")
+            self.joint_ctrl.append(joints)
+
+    def EnableArm(self, motor_num):
+        self.enabled = 1
+
+    def DisableArm(self, motor_num):
+        self.enabled = 0
+
+    def GripperCtrl(self, *args):
+        pass
+
+    def GetArmJointMsgs(self):
+        joint_state = SimpleNamespace(joint_1=0, joint_2=0, joint_3=0, joint_4=0, joint_5=0, joint_6=0)
+        return SimpleNamespace(time_stamp=0.0, joint_state=joint_state)
+
+    def GetArmLowSpdInfoMsgs(self):
+        motor = SimpleNamespace(foc_status=SimpleNamespace(driver_enable_status=self.enabled))
+        return SimpleNamespace(motor_1=motor, motor_2=motor, motor_3=motor,
+                               motor_4=motor, motor_5=motor, motor_6=motor)
+
+    def sent(self):
+        with self.lock:
+            return list(self.joint_ctrl)
+
+
+try:
+    import piper_sdk  # noqa: F401
+except ImportError:
+    # only the interface class is needed, and the tests replace it with FakePiper anyway
+    sys.modules["piper_sdk"] = types.SimpleNamespace(C_PiperInterface=FakePiper)
+
+import arm_control
+
+
+class PiperArmCtrlLoopTest(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(arm_control, "C_PiperInterface", FakePiper):
+            self.arm = arm_control.PiperArm("fake-can")
+        self.piper = self.arm.piper
+
+    def tearDown(self):
+        self.arm.stop_ctrl_loop()
+
+    def wait_settled(self, expected, timeout=2.0):
+        # the loop clears the wake event before sending the final target, so wait for both
+        deadline = time.monotonic() + timeout
+        while self.arm._ctrl_wake.is_set() or self.piper.sent()[-1:] != [expected]:
+            self.assertLess(time.monotonic(), deadline, "control loop did not settle")
+            time.sleep(0.01)
+
+    def test_loop_goes_idle_once_settled(self):
+        self.arm.joint_ctrl([1, 0, 0, 0, 0, 0])
+        self.wait_settled((1000, 0, 0, 0, 0, 0))
+
+        sent = len(self.piper.sent())
+        time.sleep(0.1)
+        self.assertEqual(len(self.piper.sent()), sent)
+        self.assertTrue(self.arm._ctrl_thread.is_alive())
+
+        self.arm.joint_ctrl([0, 2, 0, 0, 0, 0])
+        self.wait_settled((0, 2000, 0, 0, 0, 0))
+
+    def test_disable_stops_loop(self):
+        self.arm.joint_ctrl([1, 0, 0, 0, 0, 0])
+        thread = self.arm._ctrl_thread
+
+        asyncio.run(self.arm.disable())
+
+        self.assertIsNone(self.arm._ctrl_thread)
+        self.assertFalse(thread.is_alive())
+        sent = len(self.piper.sent())
+        time.sleep(0.05)
+        self.assertEqual(len(self.piper.sent()), sent)
+
+    def test_enable_resends_motion_ctrl(self):
+        self.arm.joint_ctrl([1, 0, 0, 0, 0, 0])
+        self.wait_settled((1000, 0, 0, 0, 0, 0))
+        self.assertEqual(len(self.piper.motion_ctrl), 1)
+
+        asyncio.run(self.arm.enable())
+        self.arm.joint_ctrl([2, 0, 0, 0, 0, 0])
+        self.wait_settled((2000, 0, 0, 0, 0, 0))
+        self.assertEqual(len(self.piper.motion_ctrl), 2)
+
+    def test_send_error_does_not_stop_loop(self):
+        self.piper.fail_joint_ctrl = 1
+
+        with self.assertLogs(arm_control.LOG, "ERROR"):
+            self.arm.joint_ctrl([1, 0, 0, 0, 0, 0])
+            self.wait_settled((1000, 0, 0, 0, 0, 0))
+
+    def test_rejects_invalid_targets(self):
+        out_of_range = arm_control.JOINT_CMD_MAX / 1000.0 + 1.0
+        for joints in ([float("nan"), 0, 0, 0, 0, 0],
+                       [0, float("inf"), 0, 0, 0, 0],
+                       [0, 0, -float("inf"), 0, 0, 0],
+                       [out_of_range, 0, 0, 0, 0, 0],
+                       [0, 0, 0, 0, 0, -out_of_range],
+                       [0, 0, 0, 0, 0]):
+            with self.subTest(joints=joints):
+                with self.assertRaises(ValueError):
+                    self.arm.joint_ctrl(joints)
+
+        # nothing was latched, so a valid target still goes out unchanged
+        self.assertIsNone(self.arm._ctrl_thread)
+        self.arm.joint_ctrl([1, 0, 0, 0, 0, 0])
+        self.wait_settled((1000, 0, 0, 0, 0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
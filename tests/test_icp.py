@@ -0,0 +1,135 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+from scipy.spatial import KDTree
+from scipy.spatial.transform import Rotation
+
+import icp
+
+
+def _matched_pairs(seed=0, num_points=50):
+    rng = np.random.default_rng(seed)
+    source_points = rng.normal(size=(num_points, 3))
+    closest_target_points = source_points @ np.array([[0.0, -1.0, 0.0],
+                                                      [1.0, 0.0, 0.0],
+                                                      [0.0, 0.0, 1.0]]) + 0.01 * rng.normal(size=(num_points, 3))
+    return source_points, closest_target_points
+
+
+class IcpStepRotationTest(unittest.TestCase):
+    def test_use_analytic_rotation_selects_horn_at_call_time(self):
+        source_points, closest_target_points = _matched_pairs()
+        covariance_matrix = icp.centered_covariance(source_points, closest_target_points)[2]
+        horn_rotation = icp.rotation_from_covariance(covariance_matrix)
+
+        # flip the flag back and forth in one process; a value frozen at compile time
+        # (or in the on-disk cache) would make every call take the same path
+        svd_rotation = icp.icp_step(source_points, closest_target_points, False)[0]
+        analytic_rotation = icp.icp_step(source_points, closest_target_points, True)[0]
+        svd_rotation_again = icp.icp_step(source_points, closest_target_points)[0]
+
+        np.testing.assert_array_equal(analytic_rotation, horn_rotation)
+        np.testing.assert_array_equal(svd_rotation, svd_rotation_again)
+        np.testing.assert_allclose(analytic_rotation, svd_rotation, atol=1e-12)
+
+    def test_use_analytic_rotation_routes_through_rotation_from_covariance(self):
+        source_points, closest_target_points = _matched_pairs()
+        # the pure-Python body looks rotation_from_covariance up in the module globals,
+        # so it can be swapped for a spy returning a rotation neither solver would find
+        icp_step = getattr(icp.icp_step, "py_func", icp.icp_step)
+        flip = np.diag([1.0, -1.0, -1.0])
+
+        with mock.patch.object(icp, "rotation_from_covariance", return_value=flip) as spy:
+            analytic_rotation = icp_step(source_points, closest_target_points, True)[0]
+            self.assertEqual(spy.call_count, 1)
+
+            svd_rotation = icp_step(source_points, closest_target_points, False)[0]
+            self.assertEqual(spy.call_count, 1)
+
+        np.testing.assert_array_equal(analytic_rotation, flip)
+        np.testing.assert_allclose(svd_rotation, icp.icp_step(source_points, closest_target_points)[0], atol=1e-12)
+        self.assertGreater(np.abs(svd_rotation - flip).max(), 0.5)
+
+    def test_standard_icp_passes_use_analytic_rotation(self):
+        rng = np.random.default_rng(1)
+        target_points = rng.normal(size=(200, 3))
+        source_points = target_points + np.array([0.05, -0.02, 0.01])
+
+        transform_svd = icp.standard_icp(source_points, target_points)[0]
+        transform_horn = icp.standard_icp(source_points, target_points, use_analytic_rotation=True)[0]
+
+        np.testing.assert_allclose(transform_horn, transform_svd, atol=1e-9)
+
+
+class IcpSearchAndBatchTest(unittest.TestCase):
+    def test_brute_force_matches_kdtree(self):
+        rng = np.random.default_rng(2)
+        reference_points = rng.normal(size=(40, 3))
+        query_points = rng.normal(size=(25, 3))
+
+        distances, indices = icp.closest_points_brute_force(
+            reference_points[:, 0].copy(), reference_points[:, 1].copy(), reference_points[:, 2].copy(),
+            query_points)
+        tree_distances, tree_indices = KDTree(reference_points).query(query_points)
+
+        np.testing.assert_array_equal(indices, tree_indices)
+        np.testing.assert_allclose(distances, tree_distances, atol=1e-12)
+
+    def test_standard_icp_same_result_with_brute_force_and_target_tree(self):
+        rng = np.random.default_rng(4)
+        target_points = rng.normal(size=(30, 3))
+        source_points = target_points @ Rotation.from_rotvec([0.05, -0.02, 0.1]).as_matrix().T + 0.02
+
+        # 30 points are searched exhaustively unless a tree is passed in
+        transform_brute_force = icp.standard_icp(source_points, target_points)[0]
+        transform_tree = icp.standard_icp(source_points, target_points, target_tree=KDTree(target_points))[0]
+
+        np.testing.assert_allclose(transform_tree, transform_brute_force, atol=1e-12)
+
+    def test_batched_icp_matches_standard_icp(self):
+        rng = np.random.default_rng(3)
+        for num_points in (10, 30, 100):
+            target_points = rng.normal(size=(num_points, 3))
+            source_batch = np.stack([
+                target_points @ Rotation.from_rotvec(rng.normal(scale=0.1, size=3)).as_matrix().T
+                + rng.normal(scale=0.05, size=3)
+                for _ in range(6)])
+
+            transforms = icp.batched_icp(source_batch, target_points)[0]
+
+            for source_points, transform in zip(source_batch, transforms):
+                with self.subTest(num_points=num_points):
+                    np.testing.assert_allclose(
+                        transform, icp.standard_icp(source_points, target_points)[0], atol=1e-12)
+
+    def test_rel_tolerance_stops_on_residual_plateau(self):
+        rng = np.random.default_rng(0)
+        target_points = rng.normal(size=(200, 3))
+        source_points = (target_points @ Rotation.from_rotvec([0.0, 0.0, 0.3]).as_matrix().T
+                         + np.array([0.2, -0.1, 0.05]) + 0.01 * rng.normal(size=(200, 3)))
+        # these clouds keep changing correspondences until max_iterations, so the only
+        # thing that can stop early is the plateau check on the scripted residuals
+        residuals = [1.0, 0.5, 0.4] + [0.4] * 200
+        icp_step = icp.icp_step
+
+        def scripted_step(source, matched, use_analytic_rotation=False, compute_residual=True):
+            rotation, translation, _ = icp_step(source, matched, use_analytic_rotation, compute_residual)
+            return rotation, translation, residuals[len(calls.call_args_list) - 1]
+
+        with mock.patch.object(icp, "icp_step", side_effect=scripted_step) as calls:
+            iterations_plain = icp.standard_icp(source_points, target_points, return_iterations=True)[3]
+            self.assertFalse(calls.call_args.args[3])
+
+        with mock.patch.object(icp, "icp_step", side_effect=scripted_step) as calls:
+            iterations_plateau = icp.standard_icp(
+                source_points, target_points, rel_tolerance=1e-3, patience=3, return_iterations=True)[3]
+            self.assertTrue(calls.call_args.args[3])
+
+        self.assertEqual(iterations_plain, 100)
+        # plateau at iterations 4, 5 and 6
+        self.assertEqual(iterations_plateau, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()